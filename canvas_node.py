@@ -6,23 +6,47 @@ import folder_paths
 from server import PromptServer
 from aiohttp import web
 import asyncio
+import bisect
 import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import os
-from tqdm import tqdm
-from torchvision import transforms
+import importlib.util
 try:
-    from transformers import AutoModelForImageSegmentation, PretrainedConfig
     from requests.exceptions import ConnectionError as RequestsConnectionError
-    TRANSFORMERS_AVAILABLE = True
+    # Only probed here: transformers (and torchvision) are imported when matting is first used
+    TRANSFORMERS_AVAILABLE = importlib.util.find_spec('transformers') is not None
 except ImportError:
     TRANSFORMERS_AVAILABLE = False
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+try:
+    import imagecodecs
+    IMAGECODECS_AVAILABLE = True
+except ImportError:
+    IMAGECODECS_AVAILABLE = False
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+try:
+    import pybase64
+    PYBASE64_AVAILABLE = True
+except ImportError:
+    PYBASE64_AVAILABLE = False
 import torch.nn.functional as F
 import traceback
 import uuid
 import time
 import base64
+import json
 from PIL import Image
 import io
+import struct
 import sys
 import os
 
@@ -56,45 +80,284 @@ except ImportError as e:
         print("[ERROR]", *args)
         traceback.print_exc()
 
-torch.set_float32_matmul_precision('high')
 
+# SIMD base64 (pybase64) when installed; same API and output as the stdlib functions
+if PYBASE64_AVAILABLE:
+    _b64encode = pybase64.b64encode
+    _b64decode = pybase64.b64decode
+else:
+    _b64encode = base64.b64encode
+    _b64decode = base64.b64decode
 
-class BiRefNetConfig(PretrainedConfig):
-    model_type = "BiRefNet"
 
-    def __init__(self, bb_pretrained=False, **kwargs):
-        self.bb_pretrained = bb_pretrained
-        # Add the missing is_encoder_decoder attribute for compatibility with newer transformers
-        self.is_encoder_decoder = False
-        super().__init__(**kwargs)
+def _decode_data_url(data_url):
+    # Only the payload after the first comma is sliced out; split(',') would also build a list.
+    # Both base64 decoders take the str directly
+    return _b64decode(data_url[data_url.index(',') + 1:])
 
 
-class BiRefNet(torch.nn.Module):
-    def __init__(self, config):
-        super().__init__()
+def _payload_to_bytes(payload):
+    # Binary canvas frames carry raw PNG bytes, JSON frames carry data URLs
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return payload
+    return _decode_data_url(payload)
 
-        self.encoder = torch.nn.Sequential(
-            torch.nn.Conv2d(3, 64, kernel_size=3, padding=1),
-            torch.nn.ReLU(inplace=True),
-            torch.nn.Conv2d(64, 64, kernel_size=3, padding=1),
-            torch.nn.ReLU(inplace=True)
-        )
 
-        self.decoder = torch.nn.Sequential(
-            torch.nn.Conv2d(64, 32, kernel_size=3, padding=1),
-            torch.nn.ReLU(inplace=True),
-            torch.nn.Conv2d(32, 1, kernel_size=1)
-        )
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+# PNG colour types (IHDR byte 25) that imagecodecs decodes straight into each requested mode
+_PNG_DIRECT_COLOR_TYPES = {None: (2, 6), 'RGB': (2, 6), 'L': (0,)}
+
+
+def _decode_image(image_bytes, mode=None):
+    # Decode to a uint8 array in the given PIL mode; mode=None keeps RGB or RGBA as stored.
+    # imagecodecs decodes PNG straight to numpy in one C call; PIL covers everything else.
+    # The IHDR is checked first so layouts that would need a conversion (e.g. the browser's RGBA
+    # mask PNGs requested as L) go to PIL without being decoded twice
+    header = bytes(image_bytes[:26])
+    if (IMAGECODECS_AVAILABLE and len(header) == 26 and header[:8] == _PNG_SIGNATURE
+            and header[24] == 8 and header[25] in _PNG_DIRECT_COLOR_TYPES.get(mode, ())):
+        try:
+            array = imagecodecs.png_decode(image_bytes)
+        except Exception as e:
+            log_debug(f"imagecodecs PNG decode failed, falling back to PIL: {str(e)}")
+            array = None
+        if array is not None:
+            if mode == 'RGB' and array.ndim == 3 and array.shape[2] == 4:
+                # Same as PIL's RGBA -> RGB conversion, which drops alpha
+                return np.ascontiguousarray(array[..., :3])
+            return array
+
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        if mode is None:
+            mode = 'RGBA' if img.mode == 'RGBA' else 'RGB'
+        return np.array(img if img.mode == mode else img.convert(mode))
+
+
+# PNGs built here are base64'd and sent straight to the local frontend, so favour encode
+# speed over size: zlib level 1 instead of PIL's default 6
+_PNG_COMPRESS_LEVEL = 1
+
 
-    def forward(self, x):
-        features = self.encoder(x)
-        output = self.decoder(features)
-        return [output]
+def _encode_png(array):
+    # uint8 [H, W] or [H, W, C] array -> PNG bytes (a bytes-like object). imagecodecs wraps
+    # libpng and is ~1.4-1.6x faster than PIL at the same zlib level
+    if IMAGECODECS_AVAILABLE:
+        try:
+            return imagecodecs.png_encode(array, level=_PNG_COMPRESS_LEVEL)
+        except Exception as e:
+            log_debug(f"imagecodecs PNG encode failed, falling back to PIL: {str(e)}")
+    if array.ndim == 3 and array.shape[2] == 1:
+        # Masks come in as [H, W, 1], which Image.fromarray rejects
+        array = array[..., 0]
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="PNG", compress_level=_PNG_COMPRESS_LEVEL)
+    return buffer.getbuffer()
+
+
+def _save_pil_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=_PNG_COMPRESS_LEVEL)
+    return buffer
+
+
+# Multiple of 3 so each base64 chunk encodes without padding
+_BASE64_STREAM_CHUNK = 3 * 64 * 1024
+
+
+async def _write_data_url_json(response, png_data):
+    # Write a PNG (BytesIO or bytes) as a JSON string holding a data URL (or null) without materializing it
+    if png_data is None:
+        await response.write(b'null')
+        return
+    await response.write(b'"data:image/png;base64,')
+    view = png_data.getbuffer() if isinstance(png_data, io.BytesIO) else memoryview(png_data)
+    for start in range(0, len(view), _BASE64_STREAM_CHUNK):
+        await response.write(_b64encode(view[start:start + _BASE64_STREAM_CHUNK]))
+    view.release()
+    await response.write(b'"')
+
+
+def _load_image_as_png_base64(file_path):
+    with Image.open(file_path) as img:
+        # Convert to RGB if necessary
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # Convert to base64
+        buffered = io.BytesIO()
+        img.save(buffered, format="PNG", compress_level=_PNG_COMPRESS_LEVEL)
+        return _b64encode(buffered.getbuffer()).decode('utf-8'), img.width, img.height
+
+
+if ORJSON_AVAILABLE:
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    def _json_response(data, status=200):
+        # orjson serializes straight to bytes, much faster than json.dumps on large data URLs
+        return web.Response(body=orjson.dumps(data), status=status, content_type='application/json')
+else:
+    _json_dumps = json.dumps
+    _json_response = web.json_response
+
+
+def _read_file_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# Extension sets for O(1) membership tests against os.path.splitext(name)[1].lower()
+_IMAGE_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.bmp', '.gif'})
+_LOADABLE_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.tiff', '.tif', '.ico', '.avif')
+_LOADABLE_IMAGE_EXTENSION_SET = frozenset(_LOADABLE_IMAGE_EXTENSIONS)
+
+# An unchanged output-directory mtime is only trusted for this long (seconds). On coarse-timestamp
+# filesystems (FAT, some network mounts) a file can be added within the same mtime tick, and
+# overwriting an existing file in place never touches the directory's mtime
+_OUTPUT_DIR_CACHE_TTL = 1.0
+
+
+# PNG decoding releases the GIL, so a small thread pool keeps it off the event loop
+_DECODE_POOL = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="layerforge-decode")
+
+
+# Binary canvas frame: magic, then little-endian byte lengths of the node id, image PNG and mask PNG,
+# followed by those three payloads back to back (a length of 0 means "absent")
+_CANVAS_FRAME_MAGIC = b'LFCF'
+_CANVAS_FRAME_HEADER = struct.Struct('<4sIII')
+
+
+def _parse_canvas_frame(frame):
+    magic, node_id_len, image_len, mask_len = _CANVAS_FRAME_HEADER.unpack_from(frame)
+    if magic != _CANVAS_FRAME_MAGIC:
+        raise ValueError("Not a canvas frame")
+    if _CANVAS_FRAME_HEADER.size + node_id_len + image_len + mask_len != len(frame):
+        raise ValueError("Canvas frame length does not match its header")
+    # Slice with memoryviews so the PNG payloads are not copied out of the frame
+    view = memoryview(frame)
+    start = _CANVAS_FRAME_HEADER.size
+    node_id = bytes(view[start:start + node_id_len]).decode('utf-8')
+    start += node_id_len
+    image_data = view[start:start + image_len] if image_len else None
+    start += image_len
+    mask_data = view[start:start + mask_len] if mask_len else None
+    return node_id, image_data, mask_data
+
+
+# Re-queuing a workflow without touching the canvas re-sends the same PNGs; keep recent decodes
+# by content hash. The arrays are shared, which is fine as long as consumers only read them
+# (process_canvas_image copies them into float tensors). Bounded by the arrays' total nbytes:
+# a 4K RGB canvas alone decodes to ~25 MB
+_DECODE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+_decode_cache = OrderedDict()
+_decode_cache_bytes = 0
+_decode_cache_lock = threading.Lock()
+
+
+def _decode_image_cached(payload, mode):
+    global _decode_cache_bytes
+    image_bytes = _payload_to_bytes(payload)
+    hasher = _new_content_hasher()
+    hasher.update(image_bytes)
+    key = (mode, hasher.digest())
+    with _decode_cache_lock:
+        array = _decode_cache.get(key)
+        if array is not None:
+            _decode_cache.move_to_end(key)
+            return array
+
+    array = _decode_image(image_bytes, mode)
+
+    if array.nbytes > _DECODE_CACHE_MAX_BYTES:
+        return array
+    with _decode_cache_lock:
+        # Another thread may have stored the same decode meanwhile
+        previous = _decode_cache.pop(key, None)
+        if previous is not None:
+            _decode_cache_bytes -= previous.nbytes
+        _decode_cache[key] = array
+        _decode_cache_bytes += array.nbytes
+        while _decode_cache_bytes > _DECODE_CACHE_MAX_BYTES:
+            _, evicted = _decode_cache.popitem(last=False)
+            _decode_cache_bytes -= evicted.nbytes
+    return array
+
+
+def _decode_canvas_payload(image_data, mask_data):
+    image_array = None
+    mask_array = None
+    if image_data:
+        image_array = _decode_image_cached(image_data, 'RGB')
+    if mask_data:
+        mask_array = _decode_image_cached(mask_data, 'L')
+    return image_array, mask_array
+
+
+def _squeeze_mask_to_hw(mask):
+    # [1, H, W] / [1, 1, H, W] -> [H, W] as a single view; anything with a real batch is left alone
+    if mask.dim() > 2 and mask.shape[:-2].numel() == 1:
+        return mask.reshape(mask.shape[-2:])
+    return mask
+
+
+# zlib releases the GIL too, so batch inputs are PNG-encoded concurrently
+_ENCODE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="layerforge-encode")
+
+
+# Workflows commonly re-run with unchanged inputs; remember recent encodes by content hash. Bounded
+# by the total length of the cached data URLs, so multi-megapixel or batched inputs cannot pin
+# more than this for the life of the process
+_ENCODE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_encode_cache = OrderedDict()
+_encode_cache_bytes = 0
+_encode_cache_lock = threading.Lock()
+
+
+def _new_content_hasher():
+    # Non-cryptographic content addressing only: xxh3 when available, else blake2b (still far faster than md5/sha)
+    return xxhash.xxh3_128() if XXHASH_AVAILABLE else hashlib.blake2b(digest_size=16)
+
+
+def _content_key(array, mode):
+    hasher = _new_content_hasher()
+    hasher.update(np.ascontiguousarray(array))
+    return (mode, array.shape, hasher.digest())
+
+
+def _encode_png_data_url(array, mode):
+    global _encode_cache_bytes
+    key = _content_key(array, mode)
+    with _encode_cache_lock:
+        data_url = _encode_cache.get(key)
+        if data_url is not None:
+            _encode_cache.move_to_end(key)
+            return data_url
+
+    data_url = "data:image/png;base64," + _b64encode(_encode_png(array)).decode()
+
+    if len(data_url) > _ENCODE_CACHE_MAX_BYTES:
+        return data_url
+    with _encode_cache_lock:
+        # Another thread may have stored the same encode meanwhile
+        previous = _encode_cache.pop(key, None)
+        if previous is not None:
+            _encode_cache_bytes -= len(previous)
+        _encode_cache[key] = data_url
+        _encode_cache_bytes += len(data_url)
+        while _encode_cache_bytes > _ENCODE_CACHE_MAX_BYTES:
+            _, evicted = _encode_cache.popitem(last=False)
+            _encode_cache_bytes -= len(evicted)
+    return data_url
 
 
 class LayerForgeNode:
     _canvas_data_storage = {}
     _storage_lock = threading.Lock()
+    # Latest WebSocket canvas frame per node. deque(maxlen=1) append/popleft are atomic,
+    # so the event loop and the executing node thread exchange frames without a lock.
+    _canvas_queues = {}
     
     _canvas_cache = {
         'image': None,
@@ -107,51 +370,49 @@ class LayerForgeNode:
 
     _websocket_data = {}
     _websocket_listeners = {}
+    _routes_registered = False
 
     def __init__(self):
         super().__init__()
         self.flow_id = str(uuid.uuid4())
         self.node_id = None  # Will be set when node is created
 
-        if self.__class__._canvas_cache['persistent_cache']:
+        if type(self)._canvas_cache['persistent_cache']:
             self.restore_cache()
 
     def restore_cache(self):
         try:
-            persistent = self.__class__._canvas_cache['persistent_cache']
+            cache = type(self)._canvas_cache
+            persistent = cache['persistent_cache']
             current_execution = self.get_execution_id()
 
-            if current_execution != self.__class__._canvas_cache['last_execution_id']:
+            if current_execution != cache['last_execution_id']:
                 log_info(f"New execution detected: {current_execution}")
-                self.__class__._canvas_cache['image'] = None
-                self.__class__._canvas_cache['mask'] = None
-                self.__class__._canvas_cache['last_execution_id'] = current_execution
+                cache['image'] = None
+                cache['mask'] = None
+                cache['last_execution_id'] = current_execution
             else:
 
                 if persistent.get('image') is not None:
-                    self.__class__._canvas_cache['image'] = persistent['image']
+                    cache['image'] = persistent['image']
                     log_info("Restored image from persistent cache")
                 if persistent.get('mask') is not None:
-                    self.__class__._canvas_cache['mask'] = persistent['mask']
+                    cache['mask'] = persistent['mask']
                     log_info("Restored mask from persistent cache")
         except Exception as e:
             log_error(f"Error restoring cache: {str(e)}")
 
     def get_execution_id(self):
-
-        try:
-
-            return str(int(time.time() * 1000))
-        except Exception as e:
-            log_error(f"Error getting execution ID: {str(e)}")
-            return None
+        # Monotonic integer: no float/str conversions and never goes backwards with the wall clock
+        return time.monotonic_ns()
 
     def update_persistent_cache(self):
 
         try:
-            self.__class__._canvas_cache['persistent_cache'] = {
-                'image': self.__class__._canvas_cache['image'],
-                'mask': self.__class__._canvas_cache['mask']
+            cache = type(self)._canvas_cache
+            cache['persistent_cache'] = {
+                'image': cache['image'],
+                'mask': cache['mask']
             }
             log_debug("Updated persistent cache")
         except Exception as e:
@@ -169,7 +430,7 @@ class LayerForgeNode:
         if data_info:
             log_debug(f"Data Info: {data_info}")
 
-        self.__class__._canvas_cache['data_flow_status'][self.flow_id] = flow_status
+        type(self)._canvas_cache['data_flow_status'][self.flow_id] = flow_status
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -206,8 +467,10 @@ class LayerForgeNode:
             if input_image.dim() == 4:
                 input_image = input_image.squeeze(0)
 
-            if input_image.dim() == 3 and input_image.shape[0] in [1, 3]:
-                input_image = input_image.permute(1, 2, 0)
+            # ComfyUI images are already HWC; only a CHW tensor (channels first, not last) gets permuted,
+            # and it is made contiguous once here instead of dragging a strided view downstream
+            if input_image.dim() == 3 and input_image.shape[0] in (1, 3) and input_image.shape[-1] not in (1, 3):
+                input_image = input_image.permute(1, 2, 0).contiguous()
 
             return input_image
 
@@ -222,34 +485,48 @@ class LayerForgeNode:
             if not isinstance(input_mask, torch.Tensor):
                 raise ValueError("Input mask must be a torch.Tensor")
 
-            if input_mask.dim() == 4:
-                input_mask = input_mask.squeeze(0)
-            if input_mask.dim() == 3 and input_mask.shape[0] == 1:
-                input_mask = input_mask.squeeze(0)
+            input_mask = _squeeze_mask_to_hw(input_mask)
 
-            if input_image is not None:
-                expected_shape = input_image.shape[:2]
-                if input_mask.shape != expected_shape:
-                    input_mask = F.interpolate(
-                        input_mask.unsqueeze(0).unsqueeze(0),
-                        size=expected_shape,
-                        mode='bilinear',
-                        align_corners=False
-                    ).squeeze()
+            if input_image is None:
+                return input_mask
 
-            return input_mask
+            expected_shape = input_image.shape[:2]
+            if input_mask.shape == expected_shape:
+                return input_mask
+
+            # Masks are soft (0..1), so keep bilinear resampling rather than nearest
+            return F.interpolate(
+                input_mask[None, None],
+                size=expected_shape,
+                mode='bilinear',
+                align_corners=False
+            ).squeeze_()
 
         except Exception as e:
             log_error(f"Error in add_mask_to_canvas: {str(e)}")
             return None
 
-    _processing_lock = threading.Lock()
+    # One lock per node_id: different canvases execute independently, only a duplicate run of
+    # the same node short-circuits
+    _processing_locks = {}
+    _processing_locks_guard = threading.Lock()
+
+    @classmethod
+    def _get_processing_lock(cls, node_id):
+        with cls._processing_locks_guard:
+            lock = cls._processing_locks.get(node_id)
+            if lock is None:
+                lock = cls._processing_locks[node_id] = threading.Lock()
+            return lock
 
     def process_canvas_image(self, fit_on_add, show_preview, auto_refresh_after_generation, trigger, node_id, input_image=None, input_mask=None, prompt=None, unique_id=None):
         
+        processing_lock = self._get_processing_lock(node_id)
+        acquired = False
         try:
 
-            if not self.__class__._processing_lock.acquire(blocking=False):
+            acquired = processing_lock.acquire(blocking=False)
+            if not acquired:
                 log_warn(f"Process already in progress for node {node_id}, skipping...")
 
                 return self.get_cached_data()
@@ -272,36 +549,22 @@ class LayerForgeNode:
                         batch_size = input_image.shape[0]
                         log_info(f"Processing batch of {batch_size} image(s)")
                         
+                        # Scale/cast on the tensor's device (see _to_uint8) so only uint8 is copied to the host
                         if batch_size == 1:
                             # Single image - keep backward compatibility
-                            img_np = (input_image.squeeze(0).cpu().numpy() * 255).astype(np.uint8)
-                            pil_img = Image.fromarray(img_np, 'RGB')
-                            
-                            # Convert to base64
-                            buffered = io.BytesIO()
-                            pil_img.save(buffered, format="PNG")
-                            img_str = base64.b64encode(buffered.getvalue()).decode()
-                            input_data['input_image'] = f"data:image/png;base64,{img_str}"
-                            input_data['input_image_width'] = pil_img.width
-                            input_data['input_image_height'] = pil_img.height
-                            log_debug(f"Stored single input image: {pil_img.width}x{pil_img.height}")
+                            img_np = _to_uint8(input_image.squeeze(0)).cpu().numpy()
+                            input_data['input_image'] = _encode_png_data_url(img_np, 'RGB')
+                            input_data['input_image_width'] = img_np.shape[1]
+                            input_data['input_image_height'] = img_np.shape[0]
+                            log_debug(f"Stored single input image: {img_np.shape[1]}x{img_np.shape[0]}")
                         else:
-                            # Multiple images - store as array
-                            images_array = []
-                            for i in range(batch_size):
-                                img_np = (input_image[i].cpu().numpy() * 255).astype(np.uint8)
-                                pil_img = Image.fromarray(img_np, 'RGB')
-                                
-                                # Convert to base64
-                                buffered = io.BytesIO()
-                                pil_img.save(buffered, format="PNG")
-                                img_str = base64.b64encode(buffered.getvalue()).decode()
-                                images_array.append({
-                                    'data': f"data:image/png;base64,{img_str}",
-                                    'width': pil_img.width,
-                                    'height': pil_img.height
-                                })
-                                log_debug(f"Stored batch image {i+1}/{batch_size}: {pil_img.width}x{pil_img.height}")
+                            # Multiple images - one host copy for the whole batch, encoded in parallel
+                            batch_np = _to_uint8(input_image).cpu().numpy()
+                            data_urls = _ENCODE_POOL.map(_encode_png_data_url, batch_np, ['RGB'] * batch_size)
+                            images_array = [
+                                {'data': data_url, 'width': img_np.shape[1], 'height': img_np.shape[0]}
+                                for img_np, data_url in zip(batch_np, data_urls)
+                            ]
                             
                             input_data['input_images_batch'] = images_array
                             log_info(f"Stored batch of {batch_size} images")
@@ -310,21 +573,11 @@ class LayerForgeNode:
                     # Convert mask tensor to base64
                     if isinstance(input_mask, torch.Tensor):
                         # Ensure correct shape
-                        if input_mask.dim() == 2:
-                            input_mask = input_mask.unsqueeze(0)
-                        if input_mask.dim() == 3 and input_mask.shape[0] == 1:
-                            input_mask = input_mask.squeeze(0)
-                        
-                        # Convert to numpy and then to PIL
-                        mask_np = (input_mask.cpu().numpy() * 255).astype(np.uint8)
-                        pil_mask = Image.fromarray(mask_np, 'L')
+                        input_mask = _squeeze_mask_to_hw(input_mask)
                         
-                        # Convert to base64
-                        mask_buffered = io.BytesIO()
-                        pil_mask.save(mask_buffered, format="PNG")
-                        mask_str = base64.b64encode(mask_buffered.getvalue()).decode()
-                        input_data['input_mask'] = f"data:image/png;base64,{mask_str}"
-                        log_debug(f"Stored input mask: {pil_mask.width}x{pil_mask.height}")
+                        mask_np = _to_uint8(input_mask).cpu().numpy()
+                        input_data['input_mask'] = _encode_png_data_url(mask_np, 'L')
+                        log_debug(f"Stored input mask: {mask_np.shape[1]}x{mask_np.shape[0]}")
                 
                 input_data['fit_on_add'] = fit_on_add
                 
@@ -336,25 +589,22 @@ class LayerForgeNode:
             processed_image = None
             processed_mask = None
 
-            with self.__class__._storage_lock:
-                canvas_data = self.__class__._canvas_data_storage.pop(storage_key, None)
+            canvas_queue = self.__class__._canvas_queues.get(storage_key)
+            try:
+                canvas_data = canvas_queue.popleft() if canvas_queue is not None else None
+            except IndexError:
+                canvas_data = None
 
             if canvas_data:
                 log_info(f"Canvas data found for node {storage_key} from WebSocket")
-                if canvas_data.get('image'):
-                    image_data = canvas_data['image'].split(',')[1]
-                    image_bytes = base64.b64decode(image_data)
-                    pil_image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-                    image_array = np.array(pil_image).astype(np.float32) / 255.0
-                    processed_image = torch.from_numpy(image_array)[None,]
+                # Pixels were already decoded to uint8 arrays by the WebSocket handler;
+                # keep them uint8 until they are inside torch, then scale in place
+                if canvas_data.get('image') is not None:
+                    processed_image = torch.from_numpy(canvas_data['image']).unsqueeze(0).to(torch.float32).mul_(1.0 / 255.0)
                     log_debug(f"Image loaded from WebSocket, shape: {processed_image.shape}")
 
-                if canvas_data.get('mask'):
-                    mask_data = canvas_data['mask'].split(',')[1]
-                    mask_bytes = base64.b64decode(mask_data)
-                    pil_mask = Image.open(io.BytesIO(mask_bytes)).convert('L')
-                    mask_array = np.array(pil_mask).astype(np.float32) / 255.0
-                    processed_mask = torch.from_numpy(mask_array)[None,]
+                if canvas_data.get('mask') is not None:
+                    processed_mask = torch.from_numpy(canvas_data['mask']).unsqueeze(0).to(torch.float32).mul_(1.0 / 255.0)
                     log_debug(f"Mask loaded from WebSocket, shape: {processed_mask.shape}")
             else:
                 log_warn(f"No canvas data found for node {storage_key} in WebSocket cache.")
@@ -379,14 +629,15 @@ class LayerForgeNode:
             
         finally:
 
-            if self.__class__._processing_lock.locked():
-                self.__class__._processing_lock.release()
+            if acquired:
+                processing_lock.release()
                 log_debug(f"Process completed for node {node_id}, lock released")
 
     def get_cached_data(self):
+        cache = type(self)._canvas_cache
         return {
-            'image': self.__class__._canvas_cache['image'],
-            'mask': self.__class__._canvas_cache['mask']
+            'image': cache['image'],
+            'mask': cache['mask']
         }
 
     @classmethod
@@ -402,37 +653,79 @@ class LayerForgeNode:
                 'error': str(e)
             }
 
+    _latest_image_cache = (None, None, 0.0)
+
     @classmethod
     def get_latest_image(cls):
         output_dir = folder_paths.get_output_directory()
-        files = [os.path.join(output_dir, f) for f in os.listdir(output_dir) if
-                 os.path.isfile(os.path.join(output_dir, f))]
-
-        image_files = [f for f in files if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
-
-        if not image_files:
-            return None
+        # Same check as the get_latest_images index: an unchanged directory mtime means the same
+        # answer, but only within _OUTPUT_DIR_CACHE_TTL of the scan
+        cache_key = (output_dir, os.stat(output_dir).st_mtime_ns)
+        now = time.monotonic()
+        cached_key, cached_path, cached_time = cls._latest_image_cache
+        if cached_key == cache_key and now - cached_time < _OUTPUT_DIR_CACHE_TTL:
+            return cached_path
+
+        latest_image_path = None
+        latest_ctime = None
+        # Single scandir pass: DirEntry caches the file type, so only one stat per image
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if os.path.splitext(entry.name)[1].lower() not in _IMAGE_EXTENSIONS:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    ctime = entry.stat().st_ctime
+                except OSError:
+                    continue
+                if latest_ctime is None or ctime > latest_ctime:
+                    latest_ctime = ctime
+                    latest_image_path = entry.path
 
-        latest_image_path = max(image_files, key=os.path.getctime)
+        # One tuple so concurrent readers never see a key paired with another scan's path
+        cls._latest_image_cache = (cache_key, latest_image_path, now)
         return latest_image_path
 
+    # Sorted (by mtime) image listing of the output directory, reused until the directory changes
+    # or the listing is _OUTPUT_DIR_CACHE_TTL old
+    _image_index_mtimes = []
+    _image_index_paths = []
+    _image_index_key = None
+    _image_index_time = 0.0
+    _image_index_lock = threading.Lock()
+
     @classmethod
     def get_latest_images(cls, since_timestamp=0):
         output_dir = folder_paths.get_output_directory()
-        files = []
-        for f_name in os.listdir(output_dir):
-            file_path = os.path.join(output_dir, f_name)
-            if os.path.isfile(file_path) and file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                try:
-                    mtime = os.path.getmtime(file_path)
-                    if mtime > since_timestamp:
-                        files.append((mtime, file_path))
-                except OSError:
-                    continue
-        
-        files.sort(key=lambda x: x[0])
-        
-        return [f[1] for f in files]
+        # A directory's mtime changes whenever an entry is added, removed or renamed, so while it
+        # is unchanged the previous scan is normally still the answer and polls only need a bisect
+        index_key = (output_dir, os.stat(output_dir).st_mtime_ns)
+        now = time.monotonic()
+        with cls._image_index_lock:
+            if cls._image_index_key != index_key or now - cls._image_index_time >= _OUTPUT_DIR_CACHE_TTL:
+                files = []
+                with os.scandir(output_dir) as entries:
+                    for entry in entries:
+                        if os.path.splitext(entry.name)[1].lower() not in _IMAGE_EXTENSIONS:
+                            continue
+                        try:
+                            if not entry.is_file():
+                                continue
+                            mtime = entry.stat().st_mtime
+                        except OSError:
+                            continue
+                        files.append((mtime, entry.path))
+
+                files.sort(key=lambda x: x[0])
+
+                cls._image_index_mtimes = [f[0] for f in files]
+                cls._image_index_paths = [f[1] for f in files]
+                cls._image_index_key = index_key
+                cls._image_index_time = now
+
+            start = bisect.bisect_right(cls._image_index_mtimes, since_timestamp)
+            return cls._image_index_paths[start:]
 
     @classmethod
     def get_flow_status(cls, flow_id=None):
@@ -471,29 +764,43 @@ class LayerForgeNode:
 
     @classmethod
     def setup_routes(cls):
+        # Defensive only: __init__.py calls this once, but aiohttp would append a second copy of every
+        # handler on a repeated call. A module reload builds a new class, so it is not covered
+        if cls._routes_registered:
+            return
+        cls._routes_registered = True
+
         @PromptServer.instance.routes.get("/layerforge/canvas_ws")
         async def handle_canvas_websocket(request):
             ws = web.WebSocketResponse(max_msg_size=33554432)
             await ws.prepare(request)
+
             
             async for msg in ws:
-                if msg.type == web.WSMsgType.TEXT:
+                if msg.type in (web.WSMsgType.TEXT, web.WSMsgType.BINARY):
+                    # Binary messages are raw-PNG canvas frames (see _parse_canvas_frame); text messages
+                    # are the legacy JSON/data-URL form
                     try:
-                        data = msg.json()
-                        node_id = data.get('nodeId')
+                        if msg.type == web.WSMsgType.BINARY:
+                            node_id, image_data, mask_data = _parse_canvas_frame(msg.data)
+                        else:
+                            data = msg.json()
+                            node_id = data.get('nodeId')
+                            image_data = data.get('image')
+                            mask_data = data.get('mask')
                         if not node_id:
-                            await ws.send_json({'status': 'error', 'message': 'nodeId is required'})
+                            await ws.send_json({'status': 'error', 'message': 'nodeId is required'}, dumps=_json_dumps)
                             continue
+
+                        image_array, mask_array = await asyncio.get_running_loop().run_in_executor(
+                            _DECODE_POOL, _decode_canvas_payload, image_data, mask_data
+                        )
                         
-                        image_data = data.get('image')
-                        mask_data = data.get('mask')
-                        
-                        with cls._storage_lock:
-                            cls._canvas_data_storage[node_id] = {
-                                'image': image_data,
-                                'mask': mask_data,
-                                'timestamp': time.time()
-                            }
+                        cls._canvas_queues.setdefault(node_id, deque(maxlen=1)).append({
+                            'image': image_array,
+                            'mask': mask_array,
+                            'timestamp': time.time()
+                        })
                         
                         log_info(f"Received canvas data for node {node_id} via WebSocket")
 
@@ -502,12 +809,12 @@ class LayerForgeNode:
                             'nodeId': node_id,
                             'status': 'success'
                         }
-                        await ws.send_json(ack_payload)
+                        await ws.send_json(ack_payload, dumps=_json_dumps)
                         log_debug(f"Sent ACK for node {node_id}")
                         
                     except Exception as e:
                         log_error(f"Error processing WebSocket message: {e}")
-                        await ws.send_json({'status': 'error', 'message': str(e)})
+                        await ws.send_json({'status': 'error', 'message': str(e)}, dumps=_json_dumps)
                 elif msg.type == web.WSMsgType.ERROR:
                     log_error(f"WebSocket connection closed with exception {ws.exception()}")
 
@@ -526,21 +833,21 @@ class LayerForgeNode:
                 
                 if input_data:
                     log_info(f"Input data found for node {node_id}, sending to frontend")
-                    return web.json_response({
+                    return _json_response({
                         'success': True,
                         'has_input': True,
                         'data': input_data
                     })
                 else:
                     log_debug(f"No input data found for node {node_id}")
-                    return web.json_response({
+                    return _json_response({
                         'success': True,
                         'has_input': False
                     })
                     
             except Exception as e:
                 log_error(f"Error in get_input_data: {str(e)}")
-                return web.json_response({
+                return _json_response({
                     'success': False,
                     'error': str(e)
                 }, status=500)
@@ -559,14 +866,14 @@ class LayerForgeNode:
                     else:
                         log_debug(f"No input data to clear for node {node_id}")
                 
-                return web.json_response({
+                return _json_response({
                     'success': True,
                     'message': f'Input data cleared for node {node_id}'
                 })
                     
             except Exception as e:
                 log_error(f"Error in clear_input_data: {str(e)}")
-                return web.json_response({
+                return _json_response({
                     'success': False,
                     'error': str(e)
                 }, status=500)
@@ -581,33 +888,31 @@ class LayerForgeNode:
                 log_debug(f"Cache content: {cache_data}")
                 log_debug(f"Image in cache: {cache_data['image'] is not None}")
 
-                response_data = {
-                    'success': True,
-                    'data': {
-                        'image': None,
-                        'mask': None
-                    }
-                }
-
+                # PNG encoding runs in the executor so a large image cannot stall the event loop
+                loop = asyncio.get_running_loop()
+                image_png = None
                 if cache_data['image'] is not None:
-                    pil_image = cache_data['image']
-                    buffered = io.BytesIO()
-                    pil_image.save(buffered, format="PNG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode()
-                    response_data['data']['image'] = f"data:image/png;base64,{img_str}"
+                    image_png = await loop.run_in_executor(None, _save_pil_png, cache_data['image'])
 
+                mask_png = None
                 if cache_data['mask'] is not None:
-                    pil_mask = cache_data['mask']
-                    mask_buffer = io.BytesIO()
-                    pil_mask.save(mask_buffer, format="PNG")
-                    mask_str = base64.b64encode(mask_buffer.getvalue()).decode()
-                    response_data['data']['mask'] = f"data:image/png;base64,{mask_str}"
-
-                return web.json_response(response_data)
+                    mask_png = await loop.run_in_executor(None, _save_pil_png, cache_data['mask'])
+
+                # Stream the JSON envelope and base64 in chunks instead of building the
+                # PNG bytes, base64 bytes and response string all in memory at once
+                response = web.StreamResponse(headers={'Content-Type': 'application/json; charset=utf-8'})
+                await response.prepare(request)
+                await response.write(b'{"success": true, "data": {"image": ')
+                await _write_data_url_json(response, image_png)
+                await response.write(b', "mask": ')
+                await _write_data_url_json(response, mask_png)
+                await response.write(b'}}')
+                await response.write_eof()
+                return response
 
             except Exception as e:
                 log_error(f"Error in get_canvas_data: {str(e)}")
-                return web.json_response({
+                return _json_response({
                     'success': False,
                     'error': str(e)
                 })
@@ -617,43 +922,54 @@ class LayerForgeNode:
             try:
                 since_timestamp = float(request.match_info.get('since', 0))
                 # JS Timestamps are in milliseconds, Python's are in seconds
-                latest_image_paths = cls.get_latest_images(since_timestamp / 1000.0)
-
-                images_data = []
-                for image_path in latest_image_paths:
-                    with open(image_path, "rb") as f:
-                        encoded_string = base64.b64encode(f.read()).decode('utf-8')
-                        images_data.append(f"data:image/png;base64,{encoded_string}")
-                
-                return web.json_response({
-                    'success': True,
-                    'images': images_data
-                })
+                loop = asyncio.get_running_loop()
+                latest_image_paths = await loop.run_in_executor(None, cls.get_latest_images, since_timestamp / 1000.0)
             except Exception as e:
                 log_error(f"Error in get_latest_images_route: {str(e)}")
-                return web.json_response({
+                return _json_response({
                     'success': False,
                     'error': str(e)
                 }, status=500)
 
+            # Same JSON shape as before, but streamed one file at a time: only one image is
+            # held in memory and files are read off the event loop
+            response = web.StreamResponse(headers={'Content-Type': 'application/json; charset=utf-8'})
+            await response.prepare(request)
+            await response.write(b'{"success": true, "images": [')
+            first = True
+            for image_path in latest_image_paths:
+                try:
+                    image_bytes = await loop.run_in_executor(None, _read_file_bytes, image_path)
+                except OSError as e:
+                    log_warn(f"Skipping unreadable image {image_path}: {str(e)}")
+                    continue
+                if not first:
+                    await response.write(b', ')
+                first = False
+                await _write_data_url_json(response, image_bytes)
+            await response.write(b']}')
+            await response.write_eof()
+            return response
+
         @PromptServer.instance.routes.get("/ycnode/get_latest_image")
         async def get_latest_image_route(request):
             try:
-                latest_image_path = cls.get_latest_image()
+                loop = asyncio.get_running_loop()
+                latest_image_path = await loop.run_in_executor(None, cls.get_latest_image)
                 if latest_image_path:
-                    with open(latest_image_path, "rb") as f:
-                        encoded_string = base64.b64encode(f.read()).decode('utf-8')
-                    return web.json_response({
+                    image_bytes = await loop.run_in_executor(None, _read_file_bytes, latest_image_path)
+                    encoded_string = _b64encode(image_bytes).decode('utf-8')
+                    return _json_response({
                         'success': True,
                         'image_data': f"data:image/png;base64,{encoded_string}"
                     })
                 else:
-                    return web.json_response({
+                    return _json_response({
                         'success': False,
                         'error': 'No images found in output directory.'
                     }, status=404)
             except Exception as e:
-                return web.json_response({
+                return _json_response({
                     'success': False,
                     'error': str(e)
                 }, status=500)
@@ -665,7 +981,7 @@ class LayerForgeNode:
                 file_path = data.get('file_path')
                 
                 if not file_path:
-                    return web.json_response({
+                    return _json_response({
                         'success': False,
                         'error': 'file_path is required'
                     }, status=400)
@@ -675,49 +991,42 @@ class LayerForgeNode:
                 # Check if file exists and is accessible
                 if not os.path.exists(file_path):
                     log_warn(f"File not found: {file_path}")
-                    return web.json_response({
+                    return _json_response({
                         'success': False,
                         'error': f'File not found: {file_path}'
                     }, status=404)
                 
                 # Check if it's an image file
-                valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.tiff', '.tif', '.ico', '.avif')
-                if not file_path.lower().endswith(valid_extensions):
-                    return web.json_response({
+                if os.path.splitext(file_path)[1].lower() not in _LOADABLE_IMAGE_EXTENSION_SET:
+                    return _json_response({
                         'success': False,
-                        'error': f'Invalid image file extension. Supported: {valid_extensions}'
+                        'error': f'Invalid image file extension. Supported: {_LOADABLE_IMAGE_EXTENSIONS}'
                     }, status=400)
                 
-                # Try to load and convert the image
+                # Try to load and convert the image (decode + re-encode run in the decode pool)
                 try:
-                    with Image.open(file_path) as img:
-                        # Convert to RGB if necessary
-                        if img.mode != 'RGB':
-                            img = img.convert('RGB')
-                        
-                        # Convert to base64
-                        buffered = io.BytesIO()
-                        img.save(buffered, format="PNG")
-                        img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                        
-                        log_info(f"Successfully loaded image from path: {file_path}")
-                        return web.json_response({
-                            'success': True,
-                            'image_data': f"data:image/png;base64,{img_str}",
-                            'width': img.width,
-                            'height': img.height
-                        })
-                        
+                    img_str, width, height = await asyncio.get_running_loop().run_in_executor(
+                        _DECODE_POOL, _load_image_as_png_base64, file_path
+                    )
+
+                    log_info(f"Successfully loaded image from path: {file_path}")
+                    return _json_response({
+                        'success': True,
+                        'image_data': f"data:image/png;base64,{img_str}",
+                        'width': width,
+                        'height': height
+                    })
+
                 except Exception as img_error:
                     log_error(f"Error processing image file {file_path}: {str(img_error)}")
-                    return web.json_response({
+                    return _json_response({
                         'success': False,
                         'error': f'Error processing image file: {str(img_error)}'
                     }, status=500)
                     
             except Exception as e:
                 log_error(f"Error in load_image_from_path_route: {str(e)}")
-                return web.json_response({
+                return _json_response({
                     'success': False,
                     'error': str(e)
                 }, status=500)
@@ -725,8 +1034,7 @@ class LayerForgeNode:
     def store_image(self, image_data):
 
         if isinstance(image_data, str) and image_data.startswith('data:image'):
-            image_data = image_data.split(',')[1]
-            image_bytes = base64.b64decode(image_data)
+            image_bytes = _decode_data_url(image_data)
             self.cached_image = Image.open(io.BytesIO(image_bytes))
         else:
             self.cached_image = image_data
@@ -735,8 +1043,8 @@ class LayerForgeNode:
 
         if self.cached_image:
             buffered = io.BytesIO()
-            self.cached_image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            self.cached_image.save(buffered, format="PNG", compress_level=_PNG_COMPRESS_LEVEL)
+            img_str = _b64encode(buffered.getbuffer()).decode()
             return f"data:image/png;base64,{img_str}"
         return None
 
@@ -820,15 +1128,119 @@ def _find_local_birefnet_model():
     return None
 
 
+def _is_compile_failure(error):
+    # Failures of dynamo/inductor themselves (BackendCompilerFailed covers e.g. a missing Triton).
+    # TorchRuntimeError is the traced code failing on its inputs, which eager would raise just the same
+    from torch._dynamo.exc import TorchDynamoException, TorchRuntimeError
+    return isinstance(error, TorchDynamoException) and not isinstance(error, TorchRuntimeError)
+
+
+def _compile_or_eager(fn, **compile_options):
+    # Compile fn with torch.compile on first CUDA use; if compilation is unavailable
+    # (no Triton, unsupported platform, ...) fall back to eager mode for good. Errors of the
+    # computation itself (CUDA OOM, bad shapes, ...) are raised as they are.
+    name = getattr(fn, '__name__', type(fn).__name__)
+    state = {'compiled': None, 'disabled': not hasattr(torch, 'compile')}
+
+    def fall_back(error):
+        log_warn(f"torch.compile failed for {name}, using eager mode: {str(error)}")
+        state['disabled'] = True
+
+    def run(tensor, *args):
+        if state['disabled'] or not tensor.is_cuda:
+            return fn(tensor, *args)
+        if state['compiled'] is None:
+            try:
+                state['compiled'] = torch.compile(fn, **compile_options)
+            except Exception as e:
+                # torch.compile itself rejects unsupported platforms/Python versions up front
+                fall_back(e)
+                return fn(tensor, *args)
+        try:
+            return state['compiled'](tensor, *args)
+        except Exception as e:
+            if not _is_compile_failure(e):
+                raise
+            fall_back(e)
+            return fn(tensor, *args)
+
+    return run
+
+
+def _postprocess_matte(result, size, threshold):
+    # [1, 1, h, w] logits-sigmoid -> [H, W] matte, normalized to 0..1 and optionally thresholded
+    result = F.interpolate(result, size=size, mode='bilinear', align_corners=True).squeeze()
+    # One reduction for both extremes, then in place on the freshly interpolated tensor. The clamp
+    # turns a constant matte into zeros instead of 0/0 NaNs
+    mi, ma = torch.aminmax(result)
+    result.sub_(mi).div_((ma - mi).clamp_min_(1e-8))
+    if threshold > 0:
+        result = (result > threshold).float()
+    return result
+
+
+# LAYERFORGE_MATTING_COMPILE=1 runs the backbone through torch.compile. The input is always
+# [B, 3, 1024, 1024] with B <= _MATTING_CONCURRENCY, so a static-shape compile specializes only a
+# handful of times. Opt-in: each new batch size compiles for minutes inside the request that hits it
+_COMPILE_MATTING_MODEL = os.environ.get('LAYERFORGE_MATTING_COMPILE') == '1'
+
+
+def _cuda_autocast_dtype():
+    # bf16 keeps fp32's range; older GPUs without bf16 support fall back to fp16
+    return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+
+
 class BiRefNetMatting:
+    # Built once, on first use; the pipeline holds no per-call state
+    _TRANSFORM = None
+    # Normalize(mean, std) folded into one in-place x * scale + bias pass
+    _NORM_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+    _NORM_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+    _NORM_SCALE = 1.0 / _NORM_STD
+    _NORM_BIAS = -_NORM_MEAN / _NORM_STD
+
     def __init__(self):
         self.model = None
         self.model_path = None
         self.model_cache = {}
         self.base_paths = _get_birefnet_base_paths()
+        self._cuda_stream = None
+        self._load_lock = threading.Lock()
+        self._norm_params = {}
+        self._forwards = {}
 
     def load_model(self, model_path):
+        # Requests may share this instance across executor threads; load each model only once
+        with self._load_lock:
+            self._load_model(model_path)
+
+    def _get_forward(self):
+        forward = self._forwards.get(self.model)
+        if forward is None:
+            with self._load_lock:
+                forward = self._forwards.get(self.model)
+                if forward is None:
+                    forward = self._create_forward()
+                    self._forwards[self.model] = forward
+        return forward
+
+    def _create_forward(self):
+        return _compile_or_eager(self.model, dynamic=False) if _COMPILE_MATTING_MODEL else self.model
+
+    @staticmethod
+    def _prepare_model(model):
+        # Set on first model load rather than at import: it is process-wide, and nodes that never
+        # use matting should keep torch's default fp32 matmul precision
+        torch.set_float32_matmul_precision('high')
+        model.eval()
+        if torch.cuda.is_available():
+            # BiRefNet is conv-heavy: NHWC lets cuDNN pick its faster tensor-core kernels
+            model = model.cuda().to(memory_format=torch.channels_last)
+        return model
+
+    def _load_model(self, model_path):
         from json.decoder import JSONDecodeError
+        from transformers import AutoModelForImageSegmentation
         try:
             if model_path not in self.model_cache:
                 local_model_path = _find_local_birefnet_model()
@@ -841,9 +1253,7 @@ class BiRefNetMatting:
                             local_model_path,
                             trust_remote_code=True
                         )
-                        self.model.eval()
-                        if torch.cuda.is_available():
-                            self.model = self.model.cuda()
+                        self.model = self._prepare_model(self.model)
                         self.model_cache[model_path] = self.model
                         log_info("Model loaded successfully from local disk")
                         return
@@ -864,9 +1274,7 @@ class BiRefNetMatting:
                         # Add local_files_only=False to allow downloading if needed
                         local_files_only=False
                     )
-                    self.model.eval()
-                    if torch.cuda.is_available():
-                        self.model = self.model.cuda()
+                    self.model = self._prepare_model(self.model)
                     self.model_cache[model_path] = self.model
                     log_info("Model loaded successfully from Hugging Face")
                 except AttributeError as e:
@@ -906,54 +1314,126 @@ class BiRefNetMatting:
             log_exception("Model loading failed")
             raise  # Re-raise the exception to be caught by the execute method
 
-    def preprocess_image(self, image):
-
-        try:
-
-            if isinstance(image, torch.Tensor):
-                if image.dim() == 4:
-                    image = image.squeeze(0)
-                if image.dim() == 3:
-                    image = transforms.ToPILImage()(image)
-
-            transform_image = transforms.Compose([
+    @classmethod
+    def _get_transform(cls):
+        if cls._TRANSFORM is None:
+            from torchvision import transforms
+            cls._TRANSFORM = transforms.Compose([
                 transforms.Resize((1024, 1024)),
                 transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
             ])
+        return cls._TRANSFORM
 
-            image_tensor = transform_image(image).unsqueeze(0)
+    def preprocess_image(self, image, out=None):
+        # out: optional [1, 3, 1024, 1024] slot (e.g. one row of a batch) to normalize into
 
-            if torch.cuda.is_available():
-                image_tensor = image_tensor.cuda()
+        try:
 
-            return image_tensor
+            if isinstance(image, torch.Tensor):
+                # Tensors are resized where they will be consumed (on the GPU when there is one)
+                # instead of being round-tripped through ToPILImage and a CPU resample
+                image_tensor = image if image.dim() == 4 else image.unsqueeze(0)
+                image_tensor = image_tensor.to(torch.float32)
+                if torch.cuda.is_available() and not image_tensor.is_cuda:
+                    image_tensor = image_tensor.pin_memory().to('cuda', non_blocking=True)
+                # antialias + align_corners=False matches what Resize does on a PIL image
+                image_tensor = F.interpolate(image_tensor, size=(1024, 1024), mode='bilinear',
+                                             align_corners=False, antialias=True)
+            else:
+                image_tensor = self._get_transform()(image).unsqueeze_(0)
+
+                if torch.cuda.is_available():
+                    # Stage in pinned memory so the host-to-device copy can run asynchronously
+                    image_tensor = image_tensor.pin_memory().to('cuda', non_blocking=True)
+
+            # Normalize on whichever device the tensor now lives on, with per-device cached constants
+            norm_params = self._norm_params.get(image_tensor.device)
+            if norm_params is None:
+                norm_params = (self._NORM_SCALE.to(image_tensor.device), self._NORM_BIAS.to(image_tensor.device))
+                self._norm_params[image_tensor.device] = norm_params
+            if out is not None:
+                return torch.mul(image_tensor, norm_params[0], out=out).add_(norm_params[1])
+            return image_tensor.mul_(norm_params[0]).add_(norm_params[1])
         except Exception as e:
             log_error(f"Error preprocessing image: {str(e)}")
             return None
 
+    @staticmethod
+    def _pil_to_float_tensor(image, device):
+        # ToTensor().unsqueeze(0) on the given device: the uint8 pixels are uploaded (a quarter of the
+        # bytes of a float32 copy) and reordered/scaled there
+        tensor = torch.from_numpy(np.array(image))
+        if device.type == 'cuda':
+            tensor = tensor.pin_memory().to(device, non_blocking=True)
+        tensor = tensor.unsqueeze(0) if tensor.dim() == 2 else tensor.permute(2, 0, 1)
+        return tensor.unsqueeze(0).to(torch.float32).div_(255.0)
+
     def execute(self, image, model_path, threshold=0.5, refinement=1):
+        return self.execute_batch([image], model_path, [threshold])[0]
+
+    def execute_batch(self, images, model_path, thresholds):
+        # One forward pass for several images; each keeps its own size and threshold
         try:
             PromptServer.instance.send_sync("matting_status", {"status": "processing"})
 
             self.load_model(model_path)
 
-            if isinstance(image, torch.Tensor):
-                original_size = image.shape[-2:] if image.dim() == 4 else image.shape[-2:]
-            else:
-                original_size = image.size[::-1]
+            # Canonicalize once: tensors become [1, C, H, W] float32 on the model's device, so the
+            # preprocess and the final masking share a single upload. With CUDA, PIL images take the
+            # same route (uploaded as uint8, then resized on the GPU); on CPU they stay PIL, where
+            # resizing the uint8 image before ToTensor is cheaper than a full-resolution float copy
+            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+            canonical_images = []
+            original_sizes = []
+            for image in images:
+                if device.type == 'cuda' and not isinstance(image, torch.Tensor):
+                    image = self._pil_to_float_tensor(image, device)
+                if isinstance(image, torch.Tensor):
+                    image = (image if image.dim() == 4 else image.unsqueeze(0)).to(torch.float32)
+                    if device.type == 'cuda' and not image.is_cuda:
+                        image = image.pin_memory().to(device, non_blocking=True)
+                    original_sizes.append((int(image.shape[-2]), int(image.shape[-1])))
+                else:
+                    original_sizes.append((image.size[1], image.size[0]))
+                canonical_images.append(image)
+            images = canonical_images
 
-            log_debug(f"Original size: {original_size}")
+            log_debug(f"Original sizes: {original_sizes}")
 
-            processed_image = self.preprocess_image(image)
-            if processed_image is None:
-                raise Exception("Failed to preprocess image")
+            if len(images) == 1:
+                processed_image = self.preprocess_image(images[0])
+                if processed_image is None:
+                    raise Exception("Failed to preprocess image")
+            else:
+                # Each image is normalized straight into its row of the batch, instead of into
+                # its own tensor and then copied again by torch.cat
+                processed_image = torch.empty((len(images), 3, 1024, 1024), dtype=torch.float32, device=device)
+                for index, image in enumerate(images):
+                    if self.preprocess_image(image, out=processed_image[index:index + 1]) is None:
+                        raise Exception("Failed to preprocess image")
 
             log_debug(f"Processed image shape: {processed_image.shape}")
 
-            with torch.no_grad():
-                outputs = self.model(processed_image)
-                result = outputs[-1].sigmoid().cpu()
+            stream = None
+            if processed_image.is_cuda:
+                # Match the model's channels_last weights (see _prepare_model)
+                processed_image = processed_image.contiguous(memory_format=torch.channels_last)
+                if self._cuda_stream is None:
+                    self._cuda_stream = torch.cuda.Stream()
+                stream = self._cuda_stream
+                # The non-blocking input copy was queued on the current stream
+                stream.wait_stream(torch.cuda.current_stream())
+
+            forward = self._get_forward()
+
+            results = []
+            with torch.inference_mode(), torch.cuda.stream(stream):
+                autocast_dtype = _cuda_autocast_dtype() if processed_image.is_cuda else None
+                with torch.autocast('cuda', dtype=autocast_dtype, enabled=autocast_dtype is not None):
+                    outputs = forward(processed_image)
+                # Back to fp32 before sigmoid/normalize so the matte keeps full precision; stays on
+                # the model's device so resize/normalize/threshold run there too
+                result = outputs[-1].float().sigmoid()
                 log_debug(f"Model output shape: {result.shape}")
 
                 if result.dim() == 3:
@@ -963,34 +1443,26 @@ class BiRefNetMatting:
 
                 log_debug(f"Reshaped result shape: {result.shape}")
 
-                result = F.interpolate(
-                    result,
-                    size=(original_size[0], original_size[1]),  # 明确指定高度和宽度
-                    mode='bilinear',
-                    align_corners=True
-                )
-                log_debug(f"Resized result shape: {result.shape}")
+                for index, (image, original_size, threshold) in enumerate(zip(images, original_sizes, thresholds)):
+                    # Resize, min/max normalize and threshold as one (compiled when possible) graph
+                    matte = _postprocess_matte(result[index:index + 1], original_size, threshold)
+                    log_debug(f"Post-processed result shape: {matte.shape}")
 
-                result = result.squeeze()  # 移除多余的维度
-                ma = torch.max(result)
-                mi = torch.min(result)
-                result = (result - mi) / (ma - mi)
-
-                if threshold > 0:
-                    result = (result > threshold).float()
+                    alpha_mask = matte.unsqueeze(0).unsqueeze(0)  # 确保mask是 [1, 1, H, W]
+                    if isinstance(image, torch.Tensor):
+                        masked_image = image.to(alpha_mask.device) * alpha_mask
+                    else:
+                        masked_image = self._pil_to_float_tensor(image, alpha_mask.device).mul_(alpha_mask)
+                    results.append((masked_image, alpha_mask))
 
-                alpha_mask = result.unsqueeze(0).unsqueeze(0)  # 确保mask是 [1, 1, H, W]
-                if isinstance(image, torch.Tensor):
-                    if image.dim() == 3:
-                        image = image.unsqueeze(0)
-                    masked_image = image * alpha_mask
-                else:
-                    image_tensor = transforms.ToTensor()(image).unsqueeze(0)
-                    masked_image = image_tensor * alpha_mask
+            if stream is not None:
+                # Callers read the outputs on their own stream (convert_tensor_to_base64 casts to
+                # uint8 on-device and copies only that to the host)
+                torch.cuda.current_stream().wait_stream(stream)
 
-                PromptServer.instance.send_sync("matting_status", {"status": "completed"})
+            PromptServer.instance.send_sync("matting_status", {"status": "completed"})
 
-                return (masked_image, alpha_mask)
+            return results
 
         except Exception as e:
 
@@ -1000,21 +1472,63 @@ class BiRefNetMatting:
     @classmethod
     def IS_CHANGED(cls, image, model_path, threshold, refinement):
 
-        m = hashlib.md5()
-        m.update(str(image).encode())
+        m = _new_content_hasher()
+        if isinstance(image, torch.Tensor):
+            # Fingerprint shape/dtype plus ~1k strided samples instead of hashing str(tensor)
+            flat = image.detach().reshape(-1)
+            step = max(1, flat.numel() // 1024)
+            m.update(f"{tuple(image.shape)}{image.dtype}".encode())
+            m.update(flat[::step].to(torch.float32).cpu().numpy().tobytes())
+        else:
+            m.update(str(image).encode())
         m.update(str(model_path).encode())
         m.update(str(threshold).encode())
         m.update(str(refinement).encode())
         return m.hexdigest()
 
-_matting_lock = None
+# How many /matting requests may be in flight at once (and so the largest batch); extra requests wait
+_MATTING_CONCURRENCY = max(1, int(os.environ.get('LAYERFORGE_MATTING_CONCURRENCY', '2')))
+_matting_semaphore = asyncio.Semaphore(_MATTING_CONCURRENCY)
+
+# One shared instance keeps the loaded model (and its CUDA state) alive across requests
+_matting_instance = None
+_matting_instance_lock = threading.Lock()
+
+
+def _get_matting_instance():
+    global _matting_instance
+    instance = _matting_instance
+    if instance is None:
+        with _matting_instance_lock:
+            if _matting_instance is None:
+                _matting_instance = BiRefNetMatting()
+            instance = _matting_instance
+    return instance
+
+
+_MATTING_MODEL_PATH = "BiRefNet/model.safetensors"
+
+
+def _preload_matting_model():
+    try:
+        _get_matting_instance().load_model(_MATTING_MODEL_PATH)
+        log_info("Matting model preloaded")
+    except Exception as e:
+        # The first /matting request will retry and report the error to the user
+        log_warn(f"Matting model preload failed: {str(e)}")
+
+
+# Keeping BiRefNet resident costs (V)RAM even if matting is never used, so warming it up at
+# startup is opt-in; otherwise the model loads on the first request
+if TRANSFORMERS_AVAILABLE and os.environ.get('LAYERFORGE_MATTING_PRELOAD') == '1':
+    threading.Thread(target=_preload_matting_model, name="layerforge-matting-preload", daemon=True).start()
 
 @PromptServer.instance.routes.get("/matting/check-model")
 async def check_matting_model(request):
     """Check if the matting model is available and ready to use"""
     try:
         if not TRANSFORMERS_AVAILABLE:
-            return web.json_response({
+            return _json_response({
                 "available": False,
                 "reason": "missing_dependency",
                 "message": "The 'transformers' library is required for the matting feature. Please install it by running: pip install transformers"
@@ -1026,7 +1540,7 @@ async def check_matting_model(request):
         if local_model_path:
             # Model files exist, assume it's ready
             log_info(f"BiRefNet model files detected at {local_model_path}")
-            return web.json_response({
+            return _json_response({
                 "available": True,
                 "reason": "ready",
                 "message": "Model is ready to use",
@@ -1035,7 +1549,7 @@ async def check_matting_model(request):
         else:
             searched_paths = _get_birefnet_base_paths()
             log_info(f"BiRefNet model not found in any of: {searched_paths}")
-            return web.json_response({
+            return _json_response({
                 "available": False,
                 "reason": "not_downloaded",
                 "message": "The matting model needs to be downloaded. This will happen automatically when you first use the matting feature (requires internet connection).",
@@ -1044,64 +1558,113 @@ async def check_matting_model(request):
             
     except Exception as e:
         log_error(f"Error checking matting model: {str(e)}")
-        return web.json_response({
+        return _json_response({
             "available": False,
             "reason": "error",
             "message": f"Error checking model status: {str(e)}"
         }, status=500)
 
+# Requests that arrive within this window of each other share one batched forward pass; a batch
+# never exceeds the number of requests the semaphore admits
+_MATTING_BATCH_WINDOW = 0.01
+_matting_queue = None
+_matting_worker = None
+
+
+def _get_matting_queue():
+    global _matting_queue, _matting_worker
+    if _matting_queue is None:
+        _matting_queue = asyncio.Queue()
+    if _matting_worker is None or _matting_worker.done():
+        _matting_worker = asyncio.get_running_loop().create_task(_matting_batch_worker())
+    return _matting_queue
+
+
+async def _matting_batch_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _matting_queue.get()]
+        deadline = loop.time() + _MATTING_BATCH_WINDOW
+        while len(batch) < _MATTING_CONCURRENCY:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_matting_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        log_debug(f"Running matting batch of {len(batch)}")
+        try:
+            matting_instance = _get_matting_instance()
+            results = await loop.run_in_executor(
+                None,
+                matting_instance.execute_batch,
+                [item[0] for item in batch],
+                _MATTING_MODEL_PATH,
+                [item[1] for item in batch],
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for (_, _, future), result in zip(batch, results):
+            # A request whose client went away has a cancelled future
+            if not future.done():
+                future.set_result(result)
+
+
 @PromptServer.instance.routes.post("/matting")
 async def matting(request):
-    global _matting_lock
-
     if not TRANSFORMERS_AVAILABLE:
         log_error("Matting request failed: 'transformers' library is not installed.")
-        return web.json_response({
+        return _json_response({
             "error": "Dependency Not Found",
             "details": "The 'transformers' library is required for the matting feature. Please install it by running: pip install transformers"
         }, status=400)
 
-    if _matting_lock is not None:
-        log_warn("Matting already in progress, rejecting request")
-        return web.json_response({
-            "error": "Another matting operation is in progress",
-            "details": "Please wait for the current operation to complete"
-        }, status=429)
-
-    _matting_lock = True
+    # Requests beyond the concurrency limit queue here (before their body is read) instead of failing
+    if _matting_semaphore.locked():
+        log_debug("Matting concurrency limit reached, queuing request")
+    await _matting_semaphore.acquire()
     try:
         log_info("Received matting request")
         data = await request.json()
 
-        matting_instance = BiRefNetMatting()
+        loop = asyncio.get_running_loop()
 
-        image_tensor, original_alpha = convert_base64_to_tensor(data["image"])
-        log_debug(f"Input image shape: {image_tensor.shape}")
+        # Decoding and encoding multi-megapixel PNGs takes tens of ms; keep them off the event loop too
+        # Decoded to a uint8 PIL image: execute resizes it before ToTensor instead of round-tripping
+        # a full-resolution float tensor through ToPILImage
+        input_image, original_alpha = await loop.run_in_executor(_DECODE_POOL, convert_base64_to_pil, data["image"])
+        log_debug(f"Input image size: {input_image.size}")
 
-        matted_image, alpha_mask = matting_instance.execute(
-            image_tensor,
-            "BiRefNet/model.safetensors",
-            threshold=data.get("threshold", 0.5),
-            refinement=data.get("refinement", 1)
-        )
+        # Queue for the batch worker, which runs the model off the event loop and coalesces
+        # requests that arrive together into one forward pass
+        future = loop.create_future()
+        _get_matting_queue().put_nowait((input_image, data.get("threshold", 0.5), future))
+        matted_image, alpha_mask = await future
 
-        result_image = convert_tensor_to_base64(matted_image, alpha_mask, original_alpha)
-        result_mask = convert_tensor_to_base64(alpha_mask)
+        result_image, result_mask = await loop.run_in_executor(
+            None, _encode_matting_result, matted_image, alpha_mask, original_alpha
+        )
 
-        return web.json_response({
+        return _json_response({
             "matted_image": result_image,
             "alpha_mask": result_mask
         })
 
     except RequestsConnectionError as e:
         log_error(f"Connection error during matting model download: {e}")
-        return web.json_response({
+        return _json_response({
             "error": "Network Connection Error",
             "details": "Failed to download the matting model from Hugging Face. Please check your internet connection."
         }, status=400)
     except RuntimeError as e:
         log_error(f"Runtime error during matting: {e}")
-        return web.json_response({
+        return _json_response({
             "error": "Matting Model Error",
             "details": str(e)
         }, status=500)
@@ -1109,97 +1672,122 @@ async def matting(request):
         log_exception(f"Error in matting endpoint: {e}")
         # Check for offline error message from Hugging Face
         if "Offline mode is enabled" in str(e) or "Can't load 'ZhengPeng7/BiRefNet' offline" in str(e):
-            return web.json_response({
+            return _json_response({
                 "error": "Network Connection Error",
                 "details": "Failed to download the matting model from Hugging Face. Please check your internet connection and ensure you are not in offline mode."
             }, status=400)
 
-        return web.json_response({
+        return _json_response({
             "error": "An unexpected error occurred",
             "details": traceback.format_exc()
         }, status=500)
     finally:
-        _matting_lock = None
-        log_debug("Matting lock released")
+        _matting_semaphore.release()
+        log_debug("Matting semaphore released")
 
 
-def convert_base64_to_tensor(base64_str):
-    import base64
-    import io
+def _uint8_to_float_tensor(array):
+    # Same result as transforms.ToTensor()(array).unsqueeze(0), but the CHW reorder happens
+    # on the uint8 data and the scale is in place, so there is one float allocation
+    tensor = torch.from_numpy(array)
+    tensor = tensor.unsqueeze(0) if tensor.dim() == 2 else tensor.permute(2, 0, 1)
+    return tensor.contiguous().to(torch.float32).div_(255.0).unsqueeze_(0)
 
-    try:
 
-        img_data = base64.b64decode(base64_str.split(',')[1])
-        img = Image.open(io.BytesIO(img_data))
+def _decode_composited(base64_str):
+    # uint8 RGB PIL image (alpha composited onto white) plus the raw uint8 alpha plane, or None
+    img_array = _decode_image(_decode_data_url(base64_str))
 
-        has_alpha = img.mode == 'RGBA'
-        alpha = None
-        if has_alpha:
-            alpha = img.split()[3]
+    if img_array.shape[-1] == 4:
+        alpha = img_array[..., 3]
 
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=alpha)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
+        # Compositing an opaque image onto white is a no-op; the min() is ~10x cheaper than paste()
+        if alpha.min() == 255:
+            rgb = img_array[..., :3]
+            return Image.fromarray(np.ascontiguousarray(rgb), 'RGB'), alpha
+
+        # paste() is a C loop with the exact white-background rounding; a NumPy/torch composite
+        # measured slower on CPU
+        rgba = Image.fromarray(img_array, 'RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba)
+        return background, alpha
 
-        transform = transforms.ToTensor()
-        img_tensor = transform(img).unsqueeze(0)  # [1, C, H, W]
+    return Image.fromarray(img_array, 'RGB'), None
 
-        if has_alpha:
-            alpha_tensor = transforms.ToTensor()(alpha).unsqueeze(0)  # [1, 1, H, W]
-            return img_tensor, alpha_tensor
 
-        return img_tensor, None
+def convert_base64_to_pil(base64_str):
+    # uint8 PIL image (alpha composited onto white) plus the alpha as a float tensor; the matting
+    # preprocess resizes this directly, so the full-resolution image never goes through float32
+    try:
+        img, alpha = _decode_composited(base64_str)
+        return img, (_uint8_to_float_tensor(alpha) if alpha is not None else None)  # alpha: [1, 1, H, W]
 
     except Exception as e:
-        log_error(f"Error in convert_base64_to_tensor: {str(e)}")
+        log_error(f"Error in convert_base64_to_pil: {str(e)}")
         raise
 
 
-def convert_tensor_to_base64(tensor, alpha_mask=None, original_alpha=None):
-    import base64
-    import io
+def _encode_matting_result(matted_image, alpha_mask, original_alpha):
+    return (
+        convert_tensor_to_base64(matted_image, alpha_mask, original_alpha),
+        convert_tensor_to_base64(alpha_mask),
+    )
 
-    try:
 
-        tensor = tensor.cpu()
+def _to_uint8(tensor):
+    # 0..1 float -> 0..255 uint8 (truncating, like the previous astype) in one device-side pass
+    return tensor.mul(255).clamp_(0, 255).to(torch.uint8)
 
-        if tensor.dim() == 4:
-            tensor = tensor.squeeze(0)  # 移除batch维度
-        if tensor.dim() == 3 and tensor.shape[0] in [1, 3]:
-            tensor = tensor.permute(1, 2, 0)
 
-        img_array = (tensor.numpy() * 255).astype(np.uint8)
+def _to_rgba_u8(image, alpha_mask, original_alpha):
+    # [H, W, 3] float image and two [H, W] alphas -> [H, W, 4] uint8 with the alphas' min as alpha.
+    # The min is taken before quantizing, which is equivalent as the uint8 cast is monotonic
+    alpha = _to_uint8(torch.minimum(alpha_mask, original_alpha))
+    return torch.cat([_to_uint8(image), alpha.unsqueeze(-1)], dim=-1)
 
-        if alpha_mask is not None and original_alpha is not None:
 
-            alpha_mask = alpha_mask.cpu().squeeze().numpy()
-            alpha_mask = (alpha_mask * 255).astype(np.uint8)
+def convert_tensor_to_base64(tensor, alpha_mask=None, original_alpha=None):
+    png = convert_tensor_to_png(tensor, alpha_mask, original_alpha)
+    img_str = _b64encode(png).decode()
 
-            original_alpha = original_alpha.cpu().squeeze().numpy()
-            original_alpha = (original_alpha * 255).astype(np.uint8)
+    return f"data:image/png;base64,{img_str}"
 
-            combined_alpha = np.minimum(alpha_mask, original_alpha)
 
-            img = Image.fromarray(img_array, mode='RGB')
-            alpha_img = Image.fromarray(combined_alpha, mode='L')
-            img.putalpha(alpha_img)
-        else:
+def convert_tensor_to_png(tensor, alpha_mask=None, original_alpha=None):
+    try:
+
+        if tensor.dim() == 4:
+            tensor = tensor.squeeze(0)  # 移除batch维度
+        if tensor.dim() == 3 and tensor.shape[0] in [1, 3]:
+            tensor = tensor.permute(1, 2, 0)
 
-            if img_array.shape[-1] == 1:
-                img_array = img_array.squeeze(-1)
-                img = Image.fromarray(img_array, mode='L')
+        # Scale and cast on the tensor's own device so only uint8 crosses to the host; with alphas the
+        # combined one is attached there as well, so RGBA crosses in one copy
+        if alpha_mask is not None and original_alpha is not None:
+            alpha_mask = alpha_mask.squeeze()
+            original_alpha = original_alpha.squeeze().to(alpha_mask.device, alpha_mask.dtype)
+            if alpha_mask.device == tensor.device:
+                img_u8 = _to_rgba_u8(tensor, alpha_mask, original_alpha)
             else:
-                img = Image.fromarray(img_array, mode='RGB')
+                combined_alpha = _to_uint8(torch.minimum(alpha_mask, original_alpha)).to(tensor.device)
+                img_u8 = torch.cat([_to_uint8(tensor), combined_alpha.unsqueeze(-1)], dim=-1)
+        else:
+            img_u8 = _to_uint8(tensor)
 
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
+        img_u8 = img_u8.contiguous()
+        if img_u8.is_cuda:
+            # DMA into page-locked memory instead of a pageable .cpu() copy, which the driver stages
+            # through its own bounce buffer; the caching host allocator reuses the pinned block
+            host = torch.empty(img_u8.shape, dtype=torch.uint8, pin_memory=True)
+            host.copy_(img_u8, non_blocking=True)
+            torch.cuda.current_stream(img_u8.device).synchronize()
+            img_u8 = host
 
-        return f"data:image/png;base64,{img_str}"
+        # Encoded straight from the uint8 array (RGB, RGBA or single-channel L), without a PIL image
+        return _encode_png(img_u8.cpu().numpy())
 
     except Exception as e:
-        log_error(f"Error in convert_tensor_to_base64: {str(e)}")
+        log_error(f"Error in convert_tensor_to_png: {str(e)}")
         log_debug(f"Tensor shape: {tensor.shape}, dtype: {tensor.dtype}")
         raise
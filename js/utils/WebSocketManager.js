@@ -1,6 +1,28 @@
 import { createModuleLogger } from "./LoggerUtils.js";
 import { withErrorHandling, createValidationError, createNetworkError } from "../ErrorHandler.js";
 const log = createModuleLogger('WebSocketManager');
+const CANVAS_FRAME_MAGIC = [0x4c, 0x46, 0x43, 0x46]; // "LFCF"
+const CANVAS_FRAME_HEADER_SIZE = 16;
+/**
+ * Packs canvas output into one binary frame: "LFCF", then little-endian uint32 byte lengths of the
+ * node id, image PNG and mask PNG, followed by the three payloads. Avoids base64 and JSON entirely.
+ */
+export function encodeCanvasFrame(nodeId, image, mask) {
+    const nodeIdBytes = new TextEncoder().encode(nodeId);
+    const frame = new Uint8Array(CANVAS_FRAME_HEADER_SIZE + nodeIdBytes.length + image.byteLength + mask.byteLength);
+    const header = new DataView(frame.buffer);
+    frame.set(CANVAS_FRAME_MAGIC, 0);
+    header.setUint32(4, nodeIdBytes.length, true);
+    header.setUint32(8, image.byteLength, true);
+    header.setUint32(12, mask.byteLength, true);
+    let offset = CANVAS_FRAME_HEADER_SIZE;
+    frame.set(nodeIdBytes, offset);
+    offset += nodeIdBytes.length;
+    frame.set(new Uint8Array(image), offset);
+    offset += image.byteLength;
+    frame.set(new Uint8Array(mask), offset);
+    return frame.buffer;
+}
 class WebSocketManager {
     constructor(url) {
         this.url = url;
@@ -57,7 +79,7 @@ class WebSocketManager {
                 throw createNetworkError("WebSocket connection error", { error, url: this.url });
             };
         }, 'WebSocketManager.connect');
-        this.sendMessage = withErrorHandling(async (data, requiresAck = false) => {
+        this.sendMessage = withErrorHandling(async (data, requiresAck = false, binary) => {
             if (!data || typeof data !== 'object') {
                 throw createValidationError("Message data is required", { data });
             }
@@ -66,7 +88,8 @@ class WebSocketManager {
                 throw createValidationError("A nodeId is required for messages that need acknowledgment", { data, requiresAck });
             }
             return new Promise((resolve, reject) => {
-                const message = JSON.stringify(data);
+                // A binary frame replaces the JSON encoding; `data` still carries the nodeId used for the ACK
+                const message = binary ?? JSON.stringify(data);
                 if (this.socket && this.socket.readyState === WebSocket.OPEN) {
                     this.socket.send(message);
                     log.debug("Sent message:", data);
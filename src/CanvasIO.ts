@@ -1,7 +1,7 @@
 import { createCanvas } from "./utils/CommonUtils.js";
 import { createModuleLogger } from "./utils/LoggerUtils.js";
 import { showErrorNotification } from "./utils/NotificationUtils.js";
-import { webSocketManager } from "./utils/WebSocketManager.js";
+import { webSocketManager, encodeCanvasFrame } from "./utils/WebSocketManager.js";
 import { scaleImageToFit, createImageFromSource, tensorToImageData, createImageFromImageData } from "./utils/ImageUtils.js";
 import type { Canvas } from './Canvas';
 import type { Layer, Shape } from './types';
@@ -215,7 +215,7 @@ export class CanvasIO {
         });
     }
 
-    async _renderOutputData(): Promise<{ image: string, mask: string }> {
+    async _renderOutputBlobs(): Promise<{ image: Blob, mask: Blob }> {
         log.info("=== RENDERING OUTPUT DATA FOR COMFYUI ===");
 
         // Check if layers have valid images loaded, with retry logic
@@ -248,44 +248,25 @@ export class CanvasIO {
         if (!imageBlob || !maskBlob) {
             throw new Error("Failed to generate canvas or mask blobs");
         }
-        
-        // Konwertuj blob na data URL
-        const imageDataUrl = await new Promise<string>((resolve, reject) => {
-            const reader = new FileReader();
-            reader.onload = () => resolve(reader.result as string);
-            reader.onerror = reject;
-            reader.readAsDataURL(imageBlob);
-        });
-        
-        const maskDataUrl = await new Promise<string>((resolve, reject) => {
-            const reader = new FileReader();
-            reader.onload = () => resolve(reader.result as string);
-            reader.onerror = reject;
-            reader.readAsDataURL(maskBlob);
-        });
-        
-        const bounds = this.canvas.outputAreaBounds;
-        log.info(`=== OUTPUT DATA GENERATED ===`);
-        log.info(`Image size: ${bounds.width}x${bounds.height}`);
-        log.info(`Image data URL length: ${imageDataUrl.length}`);
-        log.info(`Mask data URL length: ${maskDataUrl.length}`);
-
-        return { image: imageDataUrl, mask: maskDataUrl };
+
+        return { image: imageBlob, mask: maskBlob };
     }
 
     async sendDataViaWebSocket(nodeId: number): Promise<boolean> {
         log.info(`Preparing to send data for node ${nodeId} via WebSocket.`);
 
-        const { image, mask } = await this._renderOutputData();
+        const { image, mask } = await this._renderOutputBlobs();
+        // Send the PNG bytes as one binary frame instead of base64 data URLs inside JSON
+        const [imageBuffer, maskBuffer] = await Promise.all([image.arrayBuffer(), mask.arrayBuffer()]);
+        const frame = encodeCanvasFrame(String(nodeId), imageBuffer, maskBuffer);
+        log.info(`Image PNG: ${imageBuffer.byteLength} bytes, mask PNG: ${maskBuffer.byteLength} bytes`);
 
         try {
             log.info(`Sending data for node ${nodeId}...`);
             await webSocketManager.sendMessage({
                 type: 'canvas_data',
                 nodeId: String(nodeId),
-                image: image,
-                mask: mask,
-            }, true); // `true` requires an acknowledgment
+            }, true, frame); // `true` requires an acknowledgment
 
             log.info(`Data for node ${nodeId} has been sent and acknowledged by the server.`);
             return true;
@@ -4,9 +4,33 @@ import type { WebSocketMessage, AckCallbacks } from "../types.js";
 
 const log = createModuleLogger('WebSocketManager');
 
+const CANVAS_FRAME_MAGIC = [0x4c, 0x46, 0x43, 0x46]; // "LFCF"
+const CANVAS_FRAME_HEADER_SIZE = 16;
+
+/**
+ * Packs canvas output into one binary frame: "LFCF", then little-endian uint32 byte lengths of the
+ * node id, image PNG and mask PNG, followed by the three payloads. Avoids base64 and JSON entirely.
+ */
+export function encodeCanvasFrame(nodeId: string, image: ArrayBuffer, mask: ArrayBuffer): ArrayBuffer {
+    const nodeIdBytes = new TextEncoder().encode(nodeId);
+    const frame = new Uint8Array(CANVAS_FRAME_HEADER_SIZE + nodeIdBytes.length + image.byteLength + mask.byteLength);
+    const header = new DataView(frame.buffer);
+    frame.set(CANVAS_FRAME_MAGIC, 0);
+    header.setUint32(4, nodeIdBytes.length, true);
+    header.setUint32(8, image.byteLength, true);
+    header.setUint32(12, mask.byteLength, true);
+    let offset = CANVAS_FRAME_HEADER_SIZE;
+    frame.set(nodeIdBytes, offset);
+    offset += nodeIdBytes.length;
+    frame.set(new Uint8Array(image), offset);
+    offset += image.byteLength;
+    frame.set(new Uint8Array(mask), offset);
+    return frame.buffer;
+}
+
 class WebSocketManager {
     private socket: WebSocket | null;
-    private messageQueue: string[];
+    private messageQueue: (string | ArrayBuffer)[];
     private isConnecting: boolean;
     private reconnectAttempts: number;
     private readonly maxReconnectAttempts: number;
@@ -99,7 +123,7 @@ class WebSocketManager {
         }
     }
 
-    sendMessage = withErrorHandling(async (data: WebSocketMessage, requiresAck = false): Promise<WebSocketMessage | void> => {
+    sendMessage = withErrorHandling(async (data: WebSocketMessage, requiresAck = false, binary?: ArrayBuffer): Promise<WebSocketMessage | void> => {
         if (!data || typeof data !== 'object') {
             throw createValidationError("Message data is required", { data });
         }
@@ -110,7 +134,8 @@ class WebSocketManager {
         }
 
         return new Promise((resolve, reject) => {
-            const message = JSON.stringify(data);
+            // A binary frame replaces the JSON encoding; `data` still carries the nodeId used for the ACK
+            const message = binary ?? JSON.stringify(data);
 
             if (this.socket && this.socket.readyState === WebSocket.OPEN) {
                 this.socket.send(message);